@@ -1,12 +1,21 @@
 """
 경쟁사 주간 뉴스 수집 → LLM 요약 → Slack 발송
 """
+import asyncio
+import hashlib
 import os
+import unicodedata
+from collections import deque
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
 
-import requests
+import orjson
 from dotenv import load_dotenv
-from duckduckgo_search import DDGS
+
+if TYPE_CHECKING:
+    import requests
 
 load_dotenv()
 
@@ -14,66 +23,255 @@ load_dotenv()
 API_KEY = os.environ.get("LLM_API_KEY")
 LLM_API_URL = os.environ.get("LLM_API_URL")  # 사내 LLM API 엔드포인트
 SLACK_WEBHOOK_URL = os.environ.get("SLACK_WEBHOOK_URL")
+LLM_STREAM = os.environ.get("LLM_STREAM", "").lower() in ("1", "true", "yes")  # SSE 스트리밍 응답 사용
 
 # 검색 대상 키워드 (경쟁사)
 KEYWORDS = ["무신사", "29CM", "W컨셉", "지그재그", "에이블리", "번개장터"]
 MAX_RESULTS_PER_KEYWORD = 5
 DAYS_FILTER = 7
+SEARCH_MAX_RETRIES = 3  # rate limit 시 재시도 횟수
+SEARCH_RATE_PER_SEC = 2  # DuckDuckGo 호스트 초당 요청 상한
+LLM_MODEL = "gemini-2.5-flash"
+MAX_INPUT_CHARS = 60_000  # LLM 입력 뉴스 텍스트 상한 (약 15k 토큰)
+LLM_CACHE_DIR = Path(".cache/llm")  # 동일 프롬프트 재요청 방지용 응답 캐시
+SLACK_MAX_BLOCKS = 50  # Slack 메시지 1건당 블록 수 상한
+
+
+@lru_cache(maxsize=None)
+def get_session() -> "requests.Session":
+    """LLM / Slack 요청이 공유하는 커넥션 풀 (keep-alive 로 TLS 핸드셰이크 재사용).
+
+    requests 는 첫 호출 시점에 import (모듈 import 비용 절감).
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=16,
+            # POST 는 서버가 처리하지 않은 것이 확실한 경우에만 재시도:
+            # 연결 실패, 429/503. read timeout 등은 이미 전송됐을 수 있어 재시도 없이 원래 예외로 전달
+            # (Slack 중복 발송, LLM 중복 과금 방지)
+            max_retries=Retry(
+                total=3,
+                connect=3,
+                read=False,
+                other=False,
+                status=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 503],
+                allowed_methods=frozenset({"GET", "POST"}),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            ),
+        ),
+    )
+    return session
+
+
+class AsyncRateLimiter:
+    """슬라이딩 윈도우 방식 rate limiter. period 초 동안 최대 max_rate 회 통과."""
+
+    def __init__(self, max_rate: int, period: float = 1.0) -> None:
+        self.max_rate = max_rate
+        self.period = period
+        self._calls: deque[float] = deque()
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_rate:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(self.period - (now - self._calls[0]))
+
+    async def __aexit__(self, *exc) -> None:
+        return None
+
+
+def _parse_pub_date(date_str: str) -> datetime | None:
+    """ISO 형식 날짜 파싱 (예: 2024-07-03T16:25:22+00:00). 실패 시 None."""
+    if not date_str:
+        return None
+    # Python 3.10 이하의 fromisoformat 은 'Z' 접미사를 받지 않음
+    if date_str.endswith("Z"):
+        date_str = date_str[:-1] + "+00:00"
+    try:
+        pub_dt = datetime.fromisoformat(date_str)
+    except ValueError:
+        return None
+    if pub_dt.tzinfo is None:
+        pub_dt = pub_dt.replace(tzinfo=timezone.utc)
+    return pub_dt
+
+
+def _filter_recent(keyword: str, results: list[dict], cutoff: datetime) -> list[dict]:
+    """검색 결과 중 cutoff 이후 기사만 추려 공통 포맷으로 변환."""
+    articles = []
+    for r in results:
+        date_str = r.get("date") or ""
+        pub_dt = _parse_pub_date(date_str)
+        # 날짜를 알 수 없는 기사는 최신 기사로 간주 (timelimit="w" 로 이미 1주일 필터됨)
+        if pub_dt is None or pub_dt >= cutoff:
+            articles.append(
+                {
+                    "keyword": keyword,
+                    "title": r.get("title", ""),
+                    "body": r.get("body", ""),
+                    "url": r.get("url", ""),
+                    "date": date_str,
+                }
+            )
+    return articles
+
+
+def _search_keyword(keyword: str, cutoff: datetime) -> list[dict]:
+    """키워드 1개에 대한 DuckDuckGo 뉴스 검색 + 날짜 필터 (동기, 스레드에서 실행).
+
+    결과 파싱까지 같은 스레드에서 처리해 이벤트 루프를 막지 않음.
+    """
+    from duckduckgo_search import DDGS
+
+    with DDGS() as ddgs:
+        results = ddgs.news(
+            keywords=keyword,
+            region="kr-kr",
+            safesearch="moderate",
+            timelimit="w",
+            max_results=MAX_RESULTS_PER_KEYWORD,
+        )
+    return _filter_recent(keyword, results or [], cutoff)
+
+
+async def fetch_keyword(
+    limiter: AsyncRateLimiter, keyword: str, cutoff: datetime
+) -> list[dict]:
+    """키워드 1개 검색 + 날짜 필터. rate limit 시 지수 백오프로 재시도."""
+    from duckduckgo_search.exceptions import RatelimitException
+
+    for attempt in range(SEARCH_MAX_RETRIES):
+        try:
+            # 재시도 요청도 limiter 를 거쳐야 호스트 한도를 넘지 않음
+            async with limiter:
+                return await asyncio.to_thread(_search_keyword, keyword, cutoff)
+        except RatelimitException:
+            if attempt == SEARCH_MAX_RETRIES - 1:
+                raise
+            await asyncio.sleep(2**attempt)
+
+
+async def _search_all(cutoff: datetime) -> list[list[dict] | BaseException]:
+    # 모든 키워드가 같은 호스트(duckduckgo.com)로 가므로 limiter 하나로 동시 요청을 조절
+    limiter = AsyncRateLimiter(SEARCH_RATE_PER_SEC)
+    tasks = [fetch_keyword(limiter, keyword, cutoff) for keyword in KEYWORDS]
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _title_key(title: str) -> bytes:
+    """제목 정규화(NFKC + casefold, 공백 제거) 후 짧은 해시. 중복 기사 판별용."""
+    normalized = "".join(unicodedata.normalize("NFKC", title).casefold().split())
+    return hashlib.blake2b(normalized.encode(), digest_size=8).digest()
 
 
 def search_news() -> list[dict]:
-    """DuckDuckGo 뉴스 검색. 키워드별 3~5개, 최근 1주일 필터."""
+    """DuckDuckGo 뉴스 검색. 키워드별 3~5개, 최근 1주일 필터. 키워드는 동시에 검색."""
     cutoff = datetime.now(timezone.utc) - timedelta(days=DAYS_FILTER)
     all_articles = []
+    # 여러 키워드에 같은 기사가 걸리면 첫 번째 것만 유지 (LLM 입력 토큰 절약)
+    seen_urls: set[str] = set()
+    seen_titles: set[bytes] = set()
 
-    with DDGS() as ddgs:
-        for keyword in KEYWORDS:
-            try:
-                results = ddgs.news(
-                    keywords=keyword,
-                    region="kr-kr",
-                    safesearch="moderate",
-                    timelimit="w",
-                    max_results=MAX_RESULTS_PER_KEYWORD,
-                )
-                for r in results:
-                    date_str = r.get("date") or ""
-                    try:
-                        # ISO 형식 파싱 (예: 2024-07-03T16:25:22+00:00)
-                        pub_dt = datetime.fromisoformat(
-                            date_str.replace("Z", "+00:00")
-                        )
-                        if pub_dt.tzinfo is None:
-                            pub_dt = pub_dt.replace(tzinfo=timezone.utc)
-                    except (ValueError, TypeError):
-                        pub_dt = datetime.now(timezone.utc)
-                    if pub_dt >= cutoff:
-                        all_articles.append(
-                            {
-                                "keyword": keyword,
-                                "title": r.get("title", ""),
-                                "body": r.get("body", ""),
-                                "url": r.get("url", ""),
-                                "date": date_str,
-                            }
-                        )
-            except Exception as e:
-                print(f"[검색 오류] {keyword}: {e}")
+    # gather 는 입력 순서를 유지하므로 결과도 KEYWORDS 순서
+    for keyword, result in zip(KEYWORDS, asyncio.run(_search_all(cutoff))):
+        if isinstance(result, BaseException):
+            print(f"[검색 오류] {keyword}: {result}")
+            continue
+        for article in result:
+            url = article["url"]
+            title_key = _title_key(article["title"]) if article["title"] else None
+            if (url and url in seen_urls) or title_key in seen_titles:
                 continue
+            if url:
+                seen_urls.add(url)
+            if title_key is not None:
+                seen_titles.add(title_key)
+            all_articles.append(article)
 
     return all_articles
 
 
-def build_news_text(articles: list[dict]) -> str:
-    """LLM에 넘길 뉴스 본문 텍스트 조립."""
+def build_news_text(articles: list[dict]) -> tuple[str, int]:
+    """LLM에 넘길 뉴스 본문 텍스트 조립. MAX_INPUT_CHARS 를 넘지 않도록 기사 단위로 자름.
+
+    (본문 텍스트, 실제로 포함된 기사 수) 반환.
+    """
     if not articles:
-        return ""
+        return "", 0
     lines = []
+    total = 0
     for i, a in enumerate(articles, 1):
-        lines.append(
-            f"[{i}] 키워드: {a['keyword']}\n제목: {a['title']}\n내용: {a['body']}\nURL: {a['url']}\n"
-        )
-    return "\n".join(lines)
+        line = f"[{i}] 키워드: {a['keyword']}\n제목: {a['title']}\n내용: {a['body']}\nURL: {a['url']}\n"
+        # 기사 중간에서 잘리지 않도록, 다음 기사를 넣으면 예산을 넘는 시점에서 중단
+        total += len(line) + 1  # "\n".join 구분자 포함
+        if total > MAX_INPUT_CHARS and lines:
+            break
+        lines.append(line)
+    return "\n".join(lines), len(lines)
+
+
+def _extract_content(data: object) -> str | None:
+    """LLM API 응답에서 본문 텍스트 추출. 본문 필드를 찾지 못하면 None."""
+    # 응답 구조는 사내 API에 맞게 조정 필요 (예: data["choices"][0]["message"]["content"])
+    if isinstance(data, dict):
+        if "choices" in data and len(data["choices"]) > 0:
+            msg = data["choices"][0].get("message", {})
+            return msg.get("content")
+        if "content" in data:
+            return data["content"]
+        if "message" in data:
+            return data["message"]
+        if "text" in data:
+            return data["text"]
+    return None
+
+
+def _read_event_stream(resp: "requests.Response") -> str:
+    """SSE(data: {...}) 스트리밍 응답을 받는 대로 이어 붙여 전체 텍스트로 반환.
+
+    오류 이벤트를 받거나 본문이 비어 있으면 RuntimeError.
+    """
+    parts = []
+    # bytes 그대로 처리: charset 없는 text/event-stream 은 requests 가 ISO-8859-1 로
+    # 디코딩해 한글이 깨지므로, UTF-8 JSON 을 orjson 에 바로 넘김
+    for line in resp.iter_lines():
+        if not line or not line.startswith(b"data:"):
+            continue
+        payload = line[len(b"data:") :].strip()
+        if payload == b"[DONE]":
+            break
+        chunk = orjson.loads(payload)
+        if not isinstance(chunk, dict):
+            continue
+        if "error" in chunk:
+            raise RuntimeError(f"LLM 스트리밍 오류: {chunk['error']}")
+        # OpenAI 호환 스트리밍 포맷: choices[0].delta.content
+        for choice in chunk.get("choices") or []:
+            text = (choice.get("delta") or {}).get("content")
+            if text:
+                parts.append(text)
+    summary = "".join(parts)
+    if not summary.strip():
+        raise RuntimeError("LLM 스트리밍 응답에 본문(choices[].delta.content)이 없습니다.")
+    return summary
 
 
 def summarize_with_llm(news_text: str) -> str:
@@ -91,44 +289,59 @@ def summarize_with_llm(news_text: str) -> str:
         + news_text
     )
 
+    # 같은 모델 + 같은 프롬프트면 이전 응답 재사용 (재실행 시 LLM 호출 생략)
+    cache_key = hashlib.sha256(f"{LLM_MODEL}\n{prompt}".encode()).hexdigest()
+    cache_path = LLM_CACHE_DIR / f"{cache_key}.txt"
+    if cache_path.is_file():
+        print("LLM 캐시 적중, API 호출 생략")
+        return cache_path.read_text(encoding="utf-8")
+
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json",
         "custom-llm-provider": "vertex_ai",
     }
     body = {
-        "target_model_names": "gemini-2.5-flash",
+        "target_model_names": LLM_MODEL,
         "messages": [{"role": "user", "content": prompt}],
     }
+    if LLM_STREAM:
+        body["stream"] = True
 
-    resp = requests.post(
+    # stream=True 면 본문을 다 읽기 전까지 커넥션을 점유하므로 with 로 반납
+    with get_session().post(
         LLM_API_URL,
-        json=body,
+        data=orjson.dumps(body),
         headers=headers,
         timeout=120,
-    )
-    resp.raise_for_status()
-    data = resp.json()
+        stream=LLM_STREAM,
+    ) as resp:
+        resp.raise_for_status()
+        if resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+            content = _read_event_stream(resp)
+            summary = content
+        else:
+            data = orjson.loads(resp.content)
+            content = _extract_content(data)
+            summary = content if content is not None else str(data)
 
-    # 응답 구조는 사내 API에 맞게 조정 필요 (예: data["choices"][0]["message"]["content"])
-    if isinstance(data, dict):
-        if "choices" in data and len(data["choices"]) > 0:
-            msg = data["choices"][0].get("message", {})
-            return msg.get("content", str(data))
-        if "content" in data:
-            return data["content"]
-        if "message" in data:
-            return data["message"]
-        if "text" in data:
-            return data["text"]
-    return str(data)
+    # 실제 본문 필드에서 나온 비어 있지 않은 응답만 캐시 (오류/알 수 없는 응답 재사용 방지)
+    if isinstance(content, str) and content.strip():
+        LLM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(content, encoding="utf-8")
+    return summary
 
 
-def send_to_slack(summary: str, article_count: int) -> None:
+def send_to_slack(summary: str, article_count: int, summarized_count: int) -> None:
     """Slack Incoming Webhook으로 Block Kit 포맷 전송."""
     if not SLACK_WEBHOOK_URL:
         raise ValueError("SLACK_WEBHOOK_URL 환경 변수가 필요합니다.")
 
+    article_line = f"*수집 기사*: {article_count}건"
+    if summarized_count < article_count:
+        # 입력 길이 제한으로 일부 기사만 요약에 반영된 경우
+        article_line += f" (요약 반영 {summarized_count}건)"
+
     # Block Kit: 헤더 + 요약 본문 (3000자 제한 대비 분할)
     blocks = [
         {
@@ -139,7 +352,7 @@ def send_to_slack(summary: str, article_count: int) -> None:
             "type": "section",
             "text": {
                 "type": "mrkdwn",
-                "text": f"*기간*: 최근 1주일\n*수집 기사*: {article_count}건\n*요약* (Gemini)",
+                "text": f"*기간*: 최근 1주일\n{article_line}\n*요약* (Gemini)",
             },
         },
         {"type": "divider"},
@@ -147,22 +360,24 @@ def send_to_slack(summary: str, article_count: int) -> None:
 
     # Slack block text 최대 3000자 제한
     chunk_size = 2900
-    for i in range(0, len(summary), chunk_size):
-        chunk = summary[i : i + chunk_size]
-        blocks.append(
-            {
-                "type": "section",
-                "text": {"type": "mrkdwn", "text": chunk},
-            }
-        )
-
-    payload = {"blocks": blocks}
-    resp = requests.post(
-        SLACK_WEBHOOK_URL,
-        json=payload,
-        timeout=30,
+    blocks.extend(
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": summary[i : i + chunk_size]},
+        }
+        for i in range(0, len(summary), chunk_size)
     )
-    resp.raise_for_status()
+
+    # 메시지당 최대 50 블록 제한: 초과분은 이어지는 메시지로 나눠 전송
+    for i in range(0, len(blocks), SLACK_MAX_BLOCKS):
+        payload = {"blocks": blocks[i : i + SLACK_MAX_BLOCKS]}
+        resp = get_session().post(
+            SLACK_WEBHOOK_URL,
+            data=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+            timeout=30,
+        )
+        resp.raise_for_status()
 
 
 def main() -> None:
@@ -174,11 +389,13 @@ def main() -> None:
         print("수집된 뉴스가 없습니다. Slack에는 미발송합니다.")
         return
 
-    news_text = build_news_text(articles)
+    news_text, summarized_count = build_news_text(articles)
+    if summarized_count < len(articles):
+        print(f"[입력 제한] {len(articles) - summarized_count}건은 LLM 입력에서 제외")
     print("LLM 요약 중...")
     summary = summarize_with_llm(news_text)
     print("Slack 발송 중...")
-    send_to_slack(summary, len(articles))
+    send_to_slack(summary, len(articles), summarized_count)
     print("완료.")
 
 